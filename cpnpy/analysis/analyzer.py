@@ -37,15 +37,9 @@ class StateSpaceAnalyzer:
 
     def _precompute_enabled_transitions(self):
         """Precompute which transitions are enabled at each marking."""
-        for node in self.RG.nodes():
-            marking = self.RG.nodes[node]['marking']
-            enabled = []
-            # Find all enabled transitions by checking for any valid binding
-            for t in self.cpn.transitions:
-                bindings = self.cpn._find_all_bindings(t, marking, self.context)
-                if bindings:
-                    enabled.append(t.name)
-            self.marking_to_enabled_transitions[node] = enabled
+        for node, data in self.RG.nodes(data=True):
+            # Recorded by build_reachability_graph while exploring the node
+            self.marking_to_enabled_transitions[node] = data['enabled_transitions']
 
     # --------------------------------------------------------------------------
     # Statistics
@@ -91,7 +85,7 @@ class StateSpaceAnalyzer:
         for node in self.RG.nodes():
             marking = self.RG.nodes[node]['marking']
             for p in place_names:
-                count = len(marking.get_multiset(p).tokens)
+                count = len(marking.get_multiset(p))
                 if count < place_min[p]:
                     place_min[p] = count
                 if count > place_max[p]:
@@ -118,8 +112,8 @@ class StateSpaceAnalyzer:
             for p in place_names:
                 ms = marking.get_multiset(p)
                 val_counts = {}
-                for tok in ms.tokens:
-                    val_counts[tok.value] = val_counts.get(tok.value, 0) + 1
+                for value, _ in ms.pairs():
+                    val_counts[value] = val_counts.get(value, 0) + 1
 
                 # Update token_stats
                 for val, c in val_counts.items():
@@ -1,7 +1,9 @@
+import copy
 import networkx as nx
 from typing import Tuple, Set, Callable, Any, Dict
 from collections import deque
 from cpnpy.cpn.cpn_imp import *
+from cpnpy.cpn.cpn_imp import _key_value
 
 
 def make_hashable(obj: Any) -> Any:
@@ -26,11 +28,14 @@ def equiv_marking_to_key(marking: Marking) -> Tuple[int, Tuple[Tuple[str, Tuple[
     """
     place_entries = []
     for place_name, ms in sorted(marking._marking.items(), key=lambda x: x[0]):
-        # Convert tokens to a sorted tuple of (value, timestamp), ensuring both are hashable
-        token_list = tuple(
-            sorted((make_hashable(t.value), make_hashable(t.timestamp)) for t in ms.tokens)
-        )
-        place_entries.append((place_name, token_list))
+        # Convert tokens to a sorted tuple of (value, timestamp), ensuring both are hashable.
+        # Each distinct value is converted once for all its tokens; timestamps are plain numbers.
+        token_list = []
+        for key, stamps in ms._buckets.items():
+            value = make_hashable(_key_value(key))
+            token_list.extend((value, ts) for ts in stamps)
+        token_list.sort()
+        place_entries.append((place_name, tuple(token_list)))
     return (marking.global_clock, tuple(place_entries))
 
 
@@ -44,14 +49,9 @@ def equiv_binding(binding: Dict[str, Any]) -> Tuple[Tuple[str, Any], ...]:
 
 def copy_marking(original: Marking) -> Marking:
     """
-    Create a deep copy of a marking.
+    Create a copy of a marking, independent of the original (token values are shared).
     """
-    new_marking = Marking()
-    new_marking.global_clock = original.global_clock
-    for place_name, ms in original._marking.items():
-        tokens_copy = [Token(t.value, t.timestamp) for t in ms.tokens]
-        new_marking._marking[place_name] = Multiset(tokens_copy)
-    return new_marking
+    return copy.copy(original)
 
 
 def build_reachability_graph(
@@ -63,6 +63,8 @@ def build_reachability_graph(
 ) -> nx.DiGraph:
     """
     Build the reachability graph of the given CPN starting from initial_marking.
+    The markings stored on the nodes share unchanged multisets with each other: change them
+    through the Marking methods only, or work on a copy_marking() of them.
     """
     RG = nx.DiGraph()
     visited: Set[Any] = set()
@@ -77,10 +79,11 @@ def build_reachability_graph(
         current_key = queue.popleft()
         current_marking = RG.nodes[current_key]['marking']
 
-        # Find all enabled transitions and their bindings
+        # Find all enabled transitions and their bindings, counting the ready tokens of each place once
         enabled_transitions = []
+        ready_counts = {}
         for t in cpn.transitions:
-            bindings = cpn._find_all_bindings(t, current_marking, context)
+            bindings = cpn._find_all_bindings(t, current_marking, context, ready_counts)
             for b in bindings:
                 enabled_transitions.append((t, b))
 
@@ -91,15 +94,22 @@ def build_reachability_graph(
             if current_marking.global_clock > old_clock:
                 # Check if transitions are now enabled
                 new_enabled_transitions = []
+                ready_counts = {}
                 for t in cpn.transitions:
-                    bindings = cpn._find_all_bindings(t, current_marking, context)
+                    bindings = cpn._find_all_bindings(t, current_marking, context, ready_counts)
                     for b in bindings:
                         new_enabled_transitions.append((t, b))
                 enabled_transitions = new_enabled_transitions
 
+        # Record which transitions are enabled at this node, so that analyses need not search again
+        enabled = {trans for trans, _ in enabled_transitions}
+        RG.nodes[current_key]['enabled_transitions'] = [t.name for t in cpn.transitions if t in enabled]
+
         # For each enabled transition and binding, generate successor marking
         for (trans, binding) in enabled_transitions:
-            successor_marking = copy_marking(current_marking)
+            # Copy-on-write: the multisets are shared until a place is changed through either
+            # marking, so only the places the firing touches are actually copied
+            successor_marking = current_marking._cow_copy()
             # Fire transition
             cpn.fire_transition(trans, successor_marking, context, binding)
 
@@ -1,3 +1,4 @@
+import re
 from abc import ABC, abstractmethod
 from typing import Any, Dict, List
 
@@ -97,7 +98,7 @@ class TimeColorSet(ColorSet):
     Adjust logic as needed for real usage (e.g., Python datetime).
     """
     def is_member(self, value: Any) -> bool:
-        return isinstance(value, float) or isinstance(value, int)
+        return isinstance(value, (float, int))
 
     def __repr__(self):
         timed_str = " timed" if self.timed else ""
@@ -125,11 +126,14 @@ class ProductColorSet(ColorSet):
         super().__init__(timed=timed, name=name)
         self.cs1 = cs1
         self.cs2 = cs2
+        # Bound once, so that each membership test skips two attribute lookups per component
+        self._is_member1 = cs1.is_member
+        self._is_member2 = cs2.is_member
 
     def is_member(self, value: Any) -> bool:
         if not isinstance(value, tuple) or len(value) != 2:
             return False
-        return self.cs1.is_member(value[0]) and self.cs2.is_member(value[1])
+        return self._is_member1(value[0]) and self._is_member2(value[1])
 
     def __repr__(self):
         timed_str = " timed" if self.timed else ""
@@ -164,7 +168,8 @@ class ListColorSet(ColorSet):
     def is_member(self, value: Any) -> bool:
         if not isinstance(value, list):
             return False
-        return all(self.element_cs.is_member(elem) for elem in value)
+        is_member = self.element_cs.is_member
+        return all(is_member(elem) for elem in value)
 
     def __repr__(self):
         timed_str = " timed" if self.timed else ""
@@ -176,8 +181,28 @@ class ListColorSet(ColorSet):
 # ColorSetParser with Timed Support
 # -----------------------------------------------------------------------------------
 class ColorSetParser:
+    # "colset NAME = TYPE;" on an already stripped line; malformed lines fall back to the step-by-step checks
+    _DEFINITION_RE = re.compile(r"colset (.*?)=(.*);", re.DOTALL)
+    _PRODUCT_RE = re.compile(r"product\((.*)\)", re.DOTALL)
+    _DELIMITER_RE = re.compile(r"[(),]")
+
+    _PRIMITIVE_TYPES = {
+        "int": IntegerColorSet,
+        "real": RealColorSet,
+        "string": StringColorSet,
+        "dict": DictionaryColorSet,
+        "bool": BoolColorSet,
+        "unit": UnitColorSet,
+        "intinf": IntInfColorSet,
+        "time": TimeColorSet,
+    }
+
     def __init__(self):
         self.colorsets: Dict[str, ColorSet] = {}
+        # Unnamed, untimed primitive colour sets used as components (e.g. in "product(int, string)"),
+        # shared by all definitions of this parser. Top-level definitions always get their own
+        # instance, since the parser assigns their name and timing.
+        self._components: Dict[str, ColorSet] = {}
 
     def parse_definitions(self, text: str) -> Dict[str, ColorSet]:
         lines = text.strip().splitlines()
@@ -189,17 +214,11 @@ class ColorSetParser:
         return self.colorsets
 
     def _parse_line(self, line: str):
-        if not line.endswith(";"):
-            raise ValueError("Color set definition must end with a semicolon.")
-        line = line[:-1].strip()  # remove trailing ";"
-        if not line.startswith("colset "):
-            raise ValueError("Color set definition must start with 'colset'.")
-        line = line[len("colset "):].strip()
-        parts = line.split("=", 1)
-        if len(parts) != 2:
-            raise ValueError("Invalid color set definition format.")
-        name = parts[0].strip()
-        type_str = parts[1].strip()
+        match = self._DEFINITION_RE.fullmatch(line)
+        if match is None:
+            self._raise_line_error(line)
+        name = match.group(1).strip()
+        type_str = match.group(2).strip()
 
         # Check for "timed" keyword at the end
         timed = False
@@ -211,46 +230,43 @@ class ColorSetParser:
         cs.name = name  # Assign the parsed name to the colorset
         self.colorsets[name] = cs
 
+    @staticmethod
+    def _raise_line_error(line: str):
+        if not line.endswith(";"):
+            raise ValueError("Color set definition must end with a semicolon.")
+        line = line[:-1].strip()  # remove trailing ";"
+        if not line.startswith("colset "):
+            raise ValueError("Color set definition must start with 'colset'.")
+        raise ValueError("Invalid color set definition format.")
+
     def _parse_type(self, type_str: str, timed: bool) -> ColorSet:
+        # Direct primitive types
+        primitive = self._PRIMITIVE_TYPES.get(type_str)
+        if primitive is not None:
+            return primitive(timed=timed)
+
         # Check for enumerated type: { 'red', 'green', ... }
         if type_str.startswith("{") and type_str.endswith("}"):
             return self._parse_enumerated_type(type_str, timed)
 
-        # Direct primitive types
-        if type_str == "int":
-            return IntegerColorSet(timed=timed)
-        if type_str == "real":
-            return RealColorSet(timed=timed)
-        if type_str == "string":
-            return StringColorSet(timed=timed)
-        if type_str == "dict":
-            return DictionaryColorSet(timed=timed)
-        if type_str == "bool":
-            return BoolColorSet(timed=timed)
-        if type_str == "unit":
-            return UnitColorSet(timed=timed)
-        if type_str == "intinf":
-            return IntInfColorSet(timed=timed)
-        if type_str == "time":
-            return TimeColorSet(timed=timed)
-
         # "list" type: "list int", "list bool", "list MyEnumeratedSet", etc.
         if type_str.startswith("list "):
             sub_type = type_str[len("list "):].strip()
-            sub_cs = self._parse_type(sub_type, False)
+            sub_cs = self._parse_component(sub_type)
             return ListColorSet(sub_cs, timed=timed)
 
         # Product type
-        if type_str.startswith("product(") and type_str.endswith(")"):
-            inner = type_str[len("product("):-1].strip()
+        match = self._PRODUCT_RE.fullmatch(type_str)
+        if match is not None:
+            inner = match.group(1).strip()
             comma_index = self._find_comma_at_top_level(inner)
             if comma_index == -1:
                 raise ValueError("Invalid product definition: must have two types separated by a comma.")
             type1_str = inner[:comma_index].strip()
             type2_str = inner[comma_index + 1:].strip()
 
-            cs1 = self._parse_type(type1_str, False)
-            cs2 = self._parse_type(type2_str, False)
+            cs1 = self._parse_component(type1_str)
+            cs2 = self._parse_component(type2_str)
             return ProductColorSet(cs1, cs2, timed=timed)
 
         # If it's referencing a previously-defined colorset
@@ -262,6 +278,15 @@ class ColorSetParser:
 
         raise ValueError(f"Unknown type definition or reference: {type_str}")
 
+    def _parse_component(self, type_str: str) -> ColorSet:
+        primitive = self._PRIMITIVE_TYPES.get(type_str)
+        if primitive is None:
+            return self._parse_type(type_str, False)
+        cs = self._components.get(type_str)
+        if cs is None:
+            cs = self._components[type_str] = primitive(timed=False)
+        return cs
+
     def _parse_enumerated_type(self, type_str: str, timed: bool) -> EnumeratedColorSet:
         # remove outer braces { ... }
         inner = type_str[1:-1].strip()
@@ -284,14 +309,16 @@ class ColorSetParser:
         Finds a comma that is not nested within parentheses.
         Returns the index of that comma or -1 if none is found at top level.
         """
+        # One scan over the delimiters only; everything between them is skipped by the regex engine
         level = 0
-        for i, ch in enumerate(s):
+        for match in self._DELIMITER_RE.finditer(s):
+            ch = match.group()
             if ch == '(':
                 level += 1
             elif ch == ')':
                 level -= 1
-            elif ch == ',' and level == 0:
-                return i
+            elif level == 0:
+                return match.start()
         return -1
 
 
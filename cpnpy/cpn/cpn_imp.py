@@ -1,6 +1,10 @@
+import ast
+import bisect
 import copy
+import itertools
+import types
 from collections import Counter
-from typing import Optional, Union
+from typing import Callable, FrozenSet, Iterable, Iterator, Optional, Set, Tuple, Union
 from cpnpy.cpn.colorsets import *
 
 
@@ -8,6 +12,8 @@ from cpnpy.cpn.colorsets import *
 # Token with Time
 # -----------------------------------------------------------------------------------
 class Token:
+    __slots__ = ("value", "timestamp")
+
     def __init__(self, value: Any, timestamp: int = 0):
         self.value = value
         self.timestamp = timestamp  # For timed tokens
@@ -35,93 +41,373 @@ class Token:
         return result
 
 
+# -----------------------------------------------------------------------------------
+# Value keys for counting tokens
+# -----------------------------------------------------------------------------------
+def _frozen_hash(value: Any) -> int:
+    if isinstance(value, (list, tuple)):
+        return hash(tuple(_frozen_hash(v) for v in value))
+    if isinstance(value, dict):
+        return hash(frozenset((k, _frozen_hash(v)) for k, v in value.items()))
+    if isinstance(value, (set, frozenset)):
+        return hash(frozenset(_frozen_hash(v) for v in value))
+    try:
+        return hash(value)
+    except TypeError:
+        return 0
+
+
+class _UnhashableKey:
+    """
+    Stand-in dictionary key for token values that cannot be hashed (lists, dicts, ...).
+    Two keys are equal exactly when the wrapped values compare equal.
+    """
+    __slots__ = ("value", "_hash")
+
+    def __init__(self, value: Any):
+        self.value = value
+        self._hash = _frozen_hash(value)
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        if isinstance(other, _UnhashableKey):
+            other = other.value
+        return self.value == other
+
+
+def _value_key(value: Any) -> Any:
+    """Return a key usable in dicts/Counters that groups token values by equality."""
+    try:
+        hash(value)
+    except TypeError:
+        return _UnhashableKey(value)
+    return value
+
+
+def _key_value(key: Any) -> Any:
+    """Inverse of _value_key."""
+    return key.value if type(key) is _UnhashableKey else key
+
+
+def _count_values(values: Iterable[Any], counts: Optional[Dict[Any, int]] = None) -> Dict[Any, int]:
+    """Count values per _value_key, into counts if given."""
+    if counts is None:
+        counts = {}
+    for v in values:
+        key = _value_key(v)
+        counts[key] = counts.get(key, 0) + 1
+    return counts
+
+
+def _submultiset_ok(required: Dict[Any, int], available: Dict[Any, int]) -> bool:
+    # Counts are always positive, so more distinct values than available can never fit
+    if len(required) > len(available):
+        return False
+    for key, cnt in required.items():
+        if available.get(key, 0) < cnt:
+            return False
+    return True
+
+
+# Multiset stamps are unique across all multisets and renewed on every change,
+# so an unchanged stamp means the same multiset with the same content
+_multiset_stamps = itertools.count()
+
+
 class Multiset:
-    def __init__(self, tokens: Optional[List[Token]] = None):
-        if tokens is None:
-            tokens = []
-        self.tokens = tokens
+    """
+    Tokens grouped by value: each distinct value (keyed by _value_key) maps to the
+    timestamps of its tokens, kept in ascending order. `tokens` gives the equivalent
+    Token objects as a read-only tuple; assigning it replaces the content.
+    """
+    __slots__ = ("_buckets", "_stamp")
+
+    def __init__(self, tokens: Optional[Iterable[Union[Token, Any]]] = None):
+        self._buckets: Dict[Any, List[int]] = {}
+        self._stamp = next(_multiset_stamps)
+        if tokens is not None:
+            # Plain values are taken as untimed tokens
+            self._add_pairs((t.value, t.timestamp) if isinstance(t, Token) else (t, 0) for t in tokens)
+
+    @property
+    def tokens(self) -> Tuple[Token, ...]:
+        # A snapshot: a tuple, so that in-place edits fail instead of silently being lost
+        return tuple(Token(_key_value(key), ts) for key, stamps in self._buckets.items() for ts in stamps)
+
+    @tokens.setter
+    def tokens(self, tokens: Iterable[Union[Token, Any]]):
+        # Replaces the content, as assigning the token list used to
+        self._buckets = {}
+        self._add_pairs((t.value, t.timestamp) if isinstance(t, Token) else (t, 0) for t in tokens)
+
+    def pairs(self) -> Iterator[Tuple[Any, int]]:
+        """Yield (value, timestamp) for every token, without building Token objects."""
+        for key, stamps in self._buckets.items():
+            value = _key_value(key)
+            for ts in stamps:
+                yield value, ts
+
+    def _add_pairs(self, pairs: Iterable[Tuple[Any, int]]):
+        self._stamp = next(_multiset_stamps)
+        buckets = self._buckets
+        for value, timestamp in pairs:
+            key = _value_key(value)
+            stamps = buckets.get(key)
+            if stamps is None:
+                buckets[key] = [timestamp]
+            elif timestamp >= stamps[-1]:
+                stamps.append(timestamp)
+            else:
+                bisect.insort_right(stamps, timestamp)
 
     def add(self, token_value: Any, timestamp: int = 0, count: int = 1):
-        for _ in range(count):
-            self.tokens.append(Token(token_value, timestamp))
+        if count > 0:
+            self._stamp = next(_multiset_stamps)
+            key = _value_key(token_value)
+            stamps = self._buckets.get(key)
+            if stamps is None:
+                self._buckets[key] = [timestamp] * count
+            elif timestamp >= stamps[-1]:
+                stamps.extend([timestamp] * count)
+            else:
+                i = bisect.bisect_right(stamps, timestamp)
+                stamps[i:i] = [timestamp] * count
+
+    def extend(self, token_values: Iterable[Any], timestamp: int = 0, count: int = 1):
+        """Add count tokens of each of token_values, all with the same timestamp."""
+        if count <= 0:
+            return
+        self._stamp = next(_multiset_stamps)
+        buckets = self._buckets
+        run = [timestamp] * count
+        for value in token_values:
+            key = _value_key(value)
+            stamps = buckets.get(key)
+            if stamps is None:
+                buckets[key] = run[:]
+            elif timestamp >= stamps[-1]:
+                stamps.extend(run)
+            else:
+                i = bisect.bisect_right(stamps, timestamp)
+                stamps[i:i] = run
 
     def remove(self, token_value: Any, count: int = 1):
-        # Removing tokens that match token_value, preferring the ones with largest timestamp first
-        matching = [t for t in self.tokens if t.value == token_value]
-        if len(matching) < count:
-            raise ValueError("Not enough tokens to remove.")
-        matching.sort(key=lambda x: x.timestamp, reverse=True)
-        to_remove = matching[:count]
-        for tr in to_remove:
-            self.tokens.remove(tr)
+        self._remove_counts({_value_key(token_value): count})
+
+    def _remove_counts(self, required: Dict[Any, int]):
+        # Removing tokens of each value, preferring the ones with largest timestamp first
+        buckets = self._buckets
+        for key, cnt in required.items():
+            if len(buckets.get(key, ())) < cnt:
+                raise ValueError("Not enough tokens to remove.")
+        self._stamp = next(_multiset_stamps)
+        for key, cnt in required.items():
+            if cnt <= 0:
+                # Nothing to remove, the value need not be present
+                continue
+            stamps = buckets[key]
+            if cnt == len(stamps):
+                del buckets[key]
+            else:
+                # Timestamps are sorted, the largest ones are at the end
+                del stamps[-cnt:]
+
+    def _ready_counts(self, clock: int) -> Dict[Any, int]:
+        # Number of tokens per value key with timestamp <= clock
+        counts = {}
+        for key, stamps in self._buckets.items():
+            if stamps[-1] <= clock:
+                counts[key] = len(stamps)
+            else:
+                n = bisect.bisect_right(stamps, clock)
+                if n:
+                    counts[key] = n
+        return counts
 
     def count_value(self, token_value: Any) -> int:
-        return sum(1 for t in self.tokens if t.value == token_value)
+        return len(self._buckets.get(_value_key(token_value), ()))
+
+    def __len__(self):
+        return sum(len(stamps) for stamps in self._buckets.values())
 
     def __le__(self, other: 'Multiset') -> bool:
-        self_counts = Counter(t.value for t in self.tokens)
-        other_counts = Counter(t.value for t in other.tokens)
-        for val, cnt in self_counts.items():
-            if other_counts[val] < cnt:
+        other_buckets = other._buckets
+        # Buckets are never empty, so more distinct values than the other multiset can never fit
+        if len(self._buckets) > len(other_buckets):
+            return False
+        for key, stamps in self._buckets.items():
+            if len(other_buckets.get(key, ())) < len(stamps):
                 return False
         return True
 
     def __add__(self, other: 'Multiset') -> 'Multiset':
-        return Multiset(self.tokens + other.tokens)
+        result = copy.copy(self)
+        buckets = result._buckets
+        for key, stamps in other._buckets.items():
+            mine = buckets.get(key)
+            if mine is None:
+                buckets[key] = stamps[:]
+            else:
+                mine.extend(stamps)
+                # Two sorted runs: sort() merges them in linear time
+                mine.sort()
+        return result
 
     def __sub__(self, other: 'Multiset') -> 'Multiset':
-        result = Multiset(self.tokens[:])
-        for t in other.tokens:
-            result.remove(t.value, 1)
+        if not other <= self:
+            raise ValueError("Not enough tokens to remove.")
+        # Build the result in one pass instead of copying every bucket and trimming it afterwards
+        other_buckets = other._buckets
+        result = self.__class__.__new__(self.__class__)
+        result._buckets = {}
+        result._stamp = next(_multiset_stamps)
+        for key, stamps in self._buckets.items():
+            cnt = len(other_buckets.get(key, ()))
+            if not cnt:
+                result._buckets[key] = stamps[:]
+            elif cnt < len(stamps):
+                # Tokens with the largest timestamps are the ones removed
+                result._buckets[key] = stamps[:-cnt]
         return result
 
     def __repr__(self):
-        items_str = ", ".join(str(t) for t in self.tokens)
+        # Same text as the Token reprs, without creating the Token objects
+        items_str = ", ".join(f"Token({value}, t={ts})" if ts != 0 else f"Token({value})"
+                              for value, ts in self.pairs())
         return f"{{{items_str}}}"
 
     def __copy__(self):
         cls = self.__class__
         result = cls.__new__(cls)
-        # Shallow copy tokens list (but Token objects are referenced)
-        result.tokens = self.tokens[:]
+        # Copy the timestamp lists, the values are referenced
+        result._buckets = {key: stamps[:] for key, stamps in self._buckets.items()}
+        result._stamp = next(_multiset_stamps)
         return result
 
     def __deepcopy__(self, memo):
         cls = self.__class__
         result = cls.__new__(cls)
         memo[id(self)] = result
-        # Deepcopy tokens
-        result.tokens = [copy.deepcopy(t, memo) for t in self.tokens]
+        # Deepcopy values
+        result._buckets = {copy.deepcopy(key, memo): stamps[:] for key, stamps in self._buckets.items()}
+        result._stamp = next(_multiset_stamps)
         return result
 
 
+class _EmptyMultiset(Multiset):
+    """
+    The empty multiset shared by the places without an entry in a marking (see Marking.get_multiset).
+    It is shared by every marking, so it refuses any change; tokens are added through the marking.
+    Copies of it are plain, changeable multisets.
+    """
+    __slots__ = ()
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("The multiset of a place without tokens is read-only; add the tokens through the marking.")
+
+    tokens = property(Multiset.tokens.fget, _read_only)
+    _add_pairs = add = extend = _read_only
+
+    def _remove_counts(self, required: Dict[Any, int]):
+        # Removing nothing from an empty multiset is fine, as for any multiset
+        if any(cnt > 0 for cnt in required.values()):
+            raise ValueError("Not enough tokens to remove.")
+
+    def __sub__(self, other: Multiset) -> Multiset:
+        return Multiset() - other
+
+    def __copy__(self):
+        return Multiset()
+
+    def __deepcopy__(self, memo):
+        return Multiset()
+
+
+_EMPTY_MULTISET = _EmptyMultiset()
+_EMPTY_MULTISET._buckets = types.MappingProxyType({})
+
+
 # -----------------------------------------------------------------------------------
 # Marking with Global Clock
 # -----------------------------------------------------------------------------------
 class Marking:
+    __slots__ = ("_marking", "global_clock", "_ready", "_shared")
+
     def __init__(self):
         self._marking: Dict[str, Multiset] = {}
         self.global_clock = 0  # Time support
+        # Ready counts per place, see _ready_counts()
+        self._ready: Dict[str, Tuple[int, Multiset, int, Dict[Any, int]]] = {}
+        # Places whose multiset may be shared with another marking, see _cow_copy()
+        self._shared: Set[str] = set()
 
     def set_tokens(self, place_name: str, tokens: List[Any], timestamps: Optional[List[int]] = None):
         if timestamps is None:
             timestamps = [0] * len(tokens)
-        self._marking[place_name] = Multiset([Token(v, ts) for v, ts in zip(tokens, timestamps)])
+        ms = Multiset()
+        ms._add_pairs(zip(tokens, timestamps))
+        self._marking[place_name] = ms
+        self._shared.discard(place_name)
+        self._ready.pop(place_name, None)
 
     def add_tokens(self, place_name: str, token_values: List[Any], timestamp: int = 0):
-        ms = self._marking.get(place_name, Multiset())
-        for v in token_values:
-            ms.add(v, timestamp=timestamp)
-        self._marking[place_name] = ms
+        self._own_multiset(place_name).extend(token_values, timestamp)
+        self._ready.pop(place_name, None)
 
     def remove_tokens(self, place_name: str, token_values: List[Any]):
-        ms = self._marking.get(place_name, Multiset())
-        for v in token_values:
-            ms.remove(v)
-        self._marking[place_name] = ms
+        self._remove_counts(place_name, Counter(map(_value_key, token_values)))
+
+    def _remove_counts(self, place_name: str, counts: Dict[Any, int]):
+        # Same as remove_tokens, with the values already counted per _value_key
+        self._own_multiset(place_name)._remove_counts(counts)
+        self._ready.pop(place_name, None)
+
+    def _own_multiset(self, place_name: str) -> Multiset:
+        # The multiset of the place, created if missing and copied first if it may be shared
+        ms = self._marking.get(place_name)
+        if ms is None:
+            ms = self._marking[place_name] = Multiset()
+        elif self._shared and place_name in self._shared:
+            ms = self._marking[place_name] = copy.copy(ms)
+            self._shared.discard(place_name)
+        return ms
+
+    def _cow_copy(self) -> 'Marking':
+        """
+        Copy of this marking that shares the multisets with it (copy-on-write): whichever of
+        the two markings first changes a place through its methods copies that place's
+        multiset. Cached ready counts carry over for the places neither of them changes.
+        """
+        cls = self.__class__
+        result = cls.__new__(cls)
+        result.global_clock = self.global_clock
+        result._ready = dict(self._ready)
+        result._marking = dict(self._marking)
+        self._shared.update(self._marking)
+        result._shared = set(self._marking)
+        return result
+
+    def _ready_counts(self, place_name: str) -> Dict[Any, int]:
+        """
+        Number of ready tokens (timestamp <= global_clock) per value key in a place. The result
+        is kept until the place's multiset changes (also when changed directly, e.g. through
+        get_multiset) or the clock moves, so places that a firing does not touch are not
+        recounted; it must not be modified.
+        """
+        ms = self._marking.get(place_name, _EMPTY_MULTISET)
+        cached = self._ready.get(place_name)
+        if (cached is not None and cached[0] == self.global_clock and cached[1] is ms
+                and cached[2] == ms._stamp):
+            return cached[3]
+        counts = ms._ready_counts(self.global_clock)
+        self._ready[place_name] = (self.global_clock, ms, ms._stamp, counts)
+        return counts
 
     def get_multiset(self, place_name: str) -> Multiset:
-        return self._marking.get(place_name, Multiset())
+        # Places without an entry share one read-only empty multiset instead of allocating one per lookup
+        return self._marking.get(place_name, _EMPTY_MULTISET)
 
     def __repr__(self):
         lines = [f"Marking (global_clock={self.global_clock}):"]
@@ -135,6 +421,8 @@ class Marking:
         cls = self.__class__
         result = cls.__new__(cls)
         result.global_clock = self.global_clock
+        result._ready = {}
+        result._shared = set()
         # Shallow copy of marking dict and multiset references
         result._marking = {k: copy.copy(v) for k, v in self._marking.items()}
         return result
@@ -144,6 +432,8 @@ class Marking:
         result = cls.__new__(cls)
         memo[id(self)] = result
         result.global_clock = self.global_clock
+        result._ready = {}
+        result._shared = set()
         # Deepcopy marking dict and multisets
         result._marking = {k: copy.deepcopy(v, memo) for k, v in self._marking.items()}
         return result
@@ -152,37 +442,136 @@ class Marking:
 # -----------------------------------------------------------------------------------
 # EvaluationContext
 # -----------------------------------------------------------------------------------
+# Results kept per memoized guard before its cache is cleared
+_GUARD_CACHE_SIZE = 4096
+
+
+def _memoize_guard(fn: types.FunctionType) -> Callable[..., bool]:
+    """
+    Wraps a guard function whose result only depends on its arguments, caching the result
+    per argument tuple. Only arguments that cannot change in place (builtin immutable values,
+    see _is_immutable_value) are cached; any other call is evaluated every time.
+    """
+    results: Dict[Tuple, bool] = {}
+
+    def cached_guard(*args):
+        for arg in args:
+            if not _is_immutable_value(arg):
+                return fn(*args)
+        # The types are part of the key, also inside tuples: 1, 1.0 and True are equal, but e.g. f"{x}"
+        # tells them apart (see _value_types)
+        key = (args, _value_types(args))
+        result = results.get(key)
+        if result is not None:
+            return result
+        result = fn(*args)
+        if len(results) >= _GUARD_CACHE_SIZE:
+            results.clear()
+        results[key] = result
+        return result
+
+    return cached_guard
+
+
 class EvaluationContext:
     def __init__(self, user_code: Optional[str] = None):
         self.env = {}
+        # Compiled guard/arc expressions, keyed by their source string
+        self._code_cache: Dict[str, types.CodeType] = {}
+        # Arc expressions split on '@+' and compiled: (value code, delay code or None)
+        self._arc_cache: Dict[str, Tuple[types.CodeType, Optional[types.CodeType]]] = {}
+        # Guards as functions of their variables, keyed by (guard, parameter names); see guard_function()
+        self._guard_functions: Dict[Tuple[str, Tuple[str, ...]], Callable[..., bool]] = {}
         if user_code is not None:
-            exec(user_code, self.env)
-
-    def evaluate_guard(self, guard_expr: Optional[str], binding: Dict[str, Any]) -> bool:
+            # Run the user code once as the body of a module: its namespace is the globals of
+            # every expression, and tracebacks into it point at <cpn-user-code>
+            module = types.ModuleType("cpn_user_code")
+            exec(compile(user_code, "<cpn-user-code>", "exec"), module.__dict__)
+            self.env = module.__dict__
+
+    def _compile(self, expr: str) -> types.CodeType:
+        code = self._code_cache.get(expr)
+        if code is None:
+            # eval() on a string ignores leading blanks, compile() does not
+            code = compile(expr.lstrip(" \t"), "<cpn-expr>", "eval")
+            self._code_cache[expr] = code
+        return code
+
+    def _compile_arc(self, arc_expr: str) -> Tuple[types.CodeType, Optional[types.CodeType]]:
+        codes = self._arc_cache.get(arc_expr)
+        if codes is None:
+            if "@+" in arc_expr:
+                parts = arc_expr.split('@+')
+                codes = (self._compile(parts[0].strip()), self._compile(parts[1].strip()))
+            else:
+                codes = (self._compile(arc_expr), None)
+            self._arc_cache[arc_expr] = codes
+        return codes
+
+    def evaluate_guard(self, guard_expr: Optional[Union[str, types.CodeType]], binding: Dict[str, Any]) -> bool:
         if guard_expr is None:
             return True
+        if not isinstance(guard_expr, types.CodeType):
+            guard_expr = self._compile(guard_expr)
         return bool(eval(guard_expr, self.env, binding))
 
-    def evaluate_arc(self, arc_expr: str, binding: Dict[str, Any]) -> (List[Any], int):
+    def guard_function(self, guard_expr: str, params: Tuple[str, ...]) -> Callable[..., bool]:
+        """
+        Returns the guard as a function taking the values of params positionally, with this
+        context's environment as globals. Calling it on a binding of params gives the same
+        result as evaluate_guard, without building a frame from the binding dict.
+        A guard that references no names besides params (e.g. "x < y and y != 'a'") cannot
+        depend on the environment, so its results are memoized per argument tuple.
+        """
+        key = (guard_expr, params)
+        fn = self._guard_functions.get(key)
+        if fn is None:
+            # The expression goes on its own lines so a trailing comment cannot swallow the parentheses
+            source = f"def __guard__({', '.join(params)}):\n    return bool((\n{guard_expr}\n))\n"
+            namespace = {}
+            exec(compile(source, "<cpn-guard>", "exec"), self.env, namespace)
+            fn = namespace["__guard__"]
+            names = _analyze_arc_expression(guard_expr)[0]
+            if names is not None and names.issubset(params):
+                fn = _memoize_guard(fn)
+            self._guard_functions[key] = fn
+        return fn
+
+    def evaluate_arc(self, arc_expr: Union[str, types.CodeType], binding: Dict[str, Any]) -> (List[Any], int):
+        # A code object is an already compiled value expression, without delay
         delay = 0
-        if "@+" in arc_expr:
-            parts = arc_expr.split('@+')
-            expr_part = parts[0].strip()
-            delay_part = parts[1].strip()
-            val = eval(expr_part, self.env, binding)
-            delay = eval(delay_part, self.env, binding)
-        else:
+        if isinstance(arc_expr, types.CodeType):
             val = eval(arc_expr, self.env, binding)
+        else:
+            value_code, delay_code = self._compile_arc(arc_expr)
+            val = eval(value_code, self.env, binding)
+            if delay_code is not None:
+                delay = eval(delay_code, self.env, binding)
 
         if isinstance(val, list):
             return val, delay
         return [val], delay
 
+    def __getstate__(self):
+        # Compiled code and guard functions cannot be pickled; they are rebuilt on demand
+        return {"env": self.env}
+
+    def __setstate__(self, state):
+        self.env = state["env"]
+        self._code_cache = {}
+        self._arc_cache = {}
+        self._guard_functions = {}
+
     def __copy__(self):
         cls = self.__class__
         result = cls.__new__(cls)
         # Shallow copy environment
         result.env = self.env.copy()
+        # Code objects are immutable, so the cache can be shared
+        result._code_cache = self._code_cache
+        result._arc_cache = self._arc_cache
+        # Guard functions are bound to the environment they were defined in
+        result._guard_functions = {}
         return result
 
     def __deepcopy__(self, memo):
@@ -191,13 +580,97 @@ class EvaluationContext:
         memo[id(self)] = result
         # Deepcopy environment
         result.env = copy.deepcopy(self.env, memo)
+        result._code_cache = dict(self._code_cache)
+        result._arc_cache = dict(self._arc_cache)
+        result._guard_functions = {}
         return result
 
 
+# -----------------------------------------------------------------------------------
+# Static analysis of arc expressions
+# -----------------------------------------------------------------------------------
+def _analyze_arc_expression(expr: str) -> Tuple[Optional[FrozenSet[str]], FrozenSet[str]]:
+    """
+    Returns (names, token_names) for an arc expression:
+      - names: every name referenced by the expression (value and delay part),
+        or None if the expression cannot be parsed.
+      - token_names: the names whose value is itself one of the produced/consumed tokens,
+        i.e. the expression is `x` or a list display such as `[x, y]`.
+    """
+    if "@+" in expr:
+        parts = [p.strip() for p in expr.split('@+')[:2]]
+    else:
+        parts = [expr.strip()]
+    try:
+        trees = [ast.parse(part, mode="eval") for part in parts]
+    except SyntaxError:
+        return None, frozenset()
+
+    names = set()
+    for tree in trees:
+        names.update(node.id for node in ast.walk(tree) if isinstance(node, ast.Name))
+
+    body = trees[0].body
+    if isinstance(body, ast.Name):
+        token_names = frozenset([body.id])
+    elif isinstance(body, ast.List):
+        token_names = frozenset(e.id for e in body.elts if isinstance(e, ast.Name))
+    else:
+        token_names = frozenset()
+    return frozenset(names), token_names
+
+
+_LITERAL_NODES = (ast.Expression, ast.Constant, ast.Tuple, ast.List, ast.BinOp, ast.UnaryOp,
+                  ast.operator, ast.unaryop, ast.expr_context)
+
+
+def _is_literal_expression(source: str) -> bool:
+    """True if source only combines constants (no names, calls, attributes, subscripts...)."""
+    try:
+        tree = ast.parse(source, mode="eval")
+    except SyntaxError:
+        return False
+    return all(isinstance(node, _LITERAL_NODES) for node in ast.walk(tree))
+
+
+def _is_hashable(value: Any) -> bool:
+    try:
+        hash(value)
+    except TypeError:
+        return False
+    return True
+
+
+_IMMUTABLE_TYPES = frozenset([int, float, complex, str, bytes, bool, type(None)])
+
+
+def _is_immutable_value(value: Any) -> bool:
+    """True for values of builtin immutable types (and tuples of them): nothing can change them in place."""
+    if type(value) is tuple:
+        return all(_is_immutable_value(v) for v in value)
+    return type(value) in _IMMUTABLE_TYPES
+
+
+def _value_types(value: Any) -> Any:
+    """
+    The type of an immutable value (see _is_immutable_value), per element for tuples. Values that
+    compare equal can still differ in type (1, 1.0 and True, also inside tuples), which e.g. f"{x}" tells apart.
+    """
+    if type(value) is tuple:
+        return tuple(map(_value_types, value))
+    return type(value)
+
+
+# Per search depth: the input arcs to check and the guard's parameters (None: no guard check)
+_CheckPlan = List[Tuple[List['Arc'], Optional[Tuple[str, ...]]]]
+
+
 # -----------------------------------------------------------------------------------
 # Place, Transition, Arc, CPN with Time
 # -----------------------------------------------------------------------------------
 class Place:
+    __slots__ = ("name", "colorset")
+
     def __init__(self, name: str, colorset: ColorSet):
         self.name = name
         self.colorset = colorset
@@ -224,6 +697,8 @@ class Place:
 
 
 class Transition:
+    __slots__ = ("name", "_guard_expr", "_guard_names", "_guard_code", "variables", "transition_delay")
+
     def __init__(self, name: str, guard: Optional[str] = None, variables: Optional[List[str]] = None,
                  transition_delay: int = 0):
         self.name = name
@@ -231,6 +706,34 @@ class Transition:
         self.variables = variables if variables else []
         self.transition_delay = transition_delay
 
+    @property
+    def guard_expr(self) -> Optional[str]:
+        return self._guard_expr
+
+    @guard_expr.setter
+    def guard_expr(self, guard: Optional[str]):
+        self._guard_expr = guard
+        self._guard_names = None  # computed on demand by _guard_analysis()
+        self._guard_code = None  # compiled on demand by _compiled_guard()
+
+    def _compiled_guard(self) -> Optional[types.CodeType]:
+        if self._guard_code is None and self._guard_expr:
+            self._guard_code = compile(self._guard_expr.lstrip(" \t"), "<cpn-guard>", "eval")
+        return self._guard_code
+
+    def _guard_analysis(self) -> Optional[FrozenSet[str]]:
+        # Names referenced by the guard (None if it cannot be parsed)
+        if self._guard_names is None and self._guard_expr:
+            self._guard_names = _analyze_arc_expression(self._guard_expr)[0]
+        return self._guard_names
+
+    def __getstate__(self):
+        # Compiled guard code cannot be pickled; it is rebuilt on demand
+        return self.name, self._guard_expr, self.variables, self.transition_delay
+
+    def __setstate__(self, state):
+        self.name, self.guard_expr, self.variables, self.transition_delay = state
+
     def __repr__(self):
         guard_str = self.guard_expr if self.guard_expr is not None else "None"
         vars_str = ", ".join(self.variables) if self.variables else "None"
@@ -257,11 +760,96 @@ class Transition:
 
 
 class Arc:
+    __slots__ = ("_source", "_src_is_place", "target", "_expression", "_analysis", "_code", "_constant", "_variable")
+
     def __init__(self, source: Union['Place', 'Transition'], target: Union['Place', 'Transition'], expression: str):
         self.source = source
         self.target = target
         self.expression = expression
 
+    @property
+    def source(self) -> Union['Place', 'Transition']:
+        return self._source
+
+    @source.setter
+    def source(self, source: Union['Place', 'Transition']):
+        self._source = source
+        # Arc orientation, tagged once so that indexing needs no isinstance check
+        self._src_is_place = isinstance(source, Place)
+
+    @property
+    def expression(self) -> str:
+        return self._expression
+
+    @expression.setter
+    def expression(self, expression: str):
+        self._expression = expression
+        self._analysis = None  # computed on demand by _analyze()
+        self._code = None  # compiled on demand by evaluate_fast()
+        self._constant = None  # (values, delay) if the expression is a literal, see _compile()
+        self._variable = None  # the name, if the expression is a single name without delay
+
+    def _analyze(self) -> Tuple[Optional[FrozenSet[str]], FrozenSet[str]]:
+        if self._analysis is None:
+            self._analysis = _analyze_arc_expression(self._expression)
+        return self._analysis
+
+    def _compile(self) -> Tuple[types.CodeType, Optional[types.CodeType]]:
+        # (value code, delay code or None), split on '@+' like EvaluationContext.evaluate_arc
+        if "@+" in self._expression:
+            parts = self._expression.split('@+')
+            sources = [parts[0].strip(), parts[1].strip()]
+        else:
+            sources = [self._expression.lstrip(" \t")]
+        codes = [compile(source, "<cpn-arc>", "eval") for source in sources]
+        self._code = (codes[0], codes[1] if len(codes) > 1 else None)
+        if len(sources) == 1 and sources[0].rstrip().isidentifier():
+            self._variable = sources[0].rstrip()
+
+        # A literal expression (e.g. "1", "('a', 2)", "[1, 1] @+ 5") always yields the same tokens:
+        # evaluate it once. Only kept when the tokens are immutable, as they end up in markings.
+        if all(_is_literal_expression(source) for source in sources):
+            try:
+                values, delay = self._evaluate_code({"__builtins__": {}}, {})
+            except Exception:
+                values = None  # let evaluate_fast raise it at the usual time
+            if values is not None and all(_is_hashable(v) for v in values):
+                self._constant = (tuple(values), delay)
+        return self._code
+
+    def evaluate_fast(self, env: Dict[str, Any], binding: Dict[str, Any]) -> (List[Any], int):
+        """
+        Same result as EvaluationContext.evaluate_arc(self.expression, binding) for a context
+        whose environment is env, using the code compiled for this arc.
+        """
+        if self._code is None:
+            self._compile()
+        if self._constant is not None:
+            values, delay = self._constant
+            return list(values), delay
+        if self._variable is not None and self._variable in binding:
+            # A plain variable such as "x": its value, without running the interpreter
+            val = binding[self._variable]
+            if isinstance(val, list):
+                return val, 0
+            return [val], 0
+        return self._evaluate_code(env, binding)
+
+    def _evaluate_code(self, env: Dict[str, Any], binding: Dict[str, Any]) -> (List[Any], int):
+        value_code, delay_code = self._code
+        val = eval(value_code, env, binding)
+        delay = 0 if delay_code is None else eval(delay_code, env, binding)
+        if isinstance(val, list):
+            return val, delay
+        return [val], delay
+
+    def __getstate__(self):
+        # Compiled code cannot be pickled; it is rebuilt on demand
+        return self.source, self.target, self._expression
+
+    def __setstate__(self, state):
+        self.source, self.target, self.expression = state
+
     def __repr__(self):
         src_name = self.source.name if isinstance(self.source, Place) else self.source.name
         tgt_name = self.target.name if isinstance(self.target, Place) else self.target.name
@@ -290,33 +878,76 @@ class CPN:
         self.places: List[Place] = []
         self.transitions: List[Transition] = []
         self.arcs: List[Arc] = []
+        self._build_indexes()
+
+    def _build_indexes(self):
+        # Name and adjacency lookups, kept in sync by add_place/add_transition/add_arc
+        self._place_by_name: Dict[str, Place] = {}
+        self._transition_by_name: Dict[str, Transition] = {}
+        self._in_arcs: Dict[Transition, List[Arc]] = {}
+        self._out_arcs: Dict[Transition, List[Arc]] = {}
+        for p in self.places:
+            self._index_place(p)
+        for t in self.transitions:
+            self._index_transition(t)
+        for a in self.arcs:
+            self._index_arc(a)
+        # Last search result per transition: (input place stamps, clock, context, search signature, binding)
+        self._binding_cache: Dict[Transition, Tuple] = {}
+        # Per transition: (search signature, whether it only depends on the marking), see _search_signature()
+        self._signature_cache: Dict[Transition, Tuple[Tuple, bool]] = {}
+        # Pruning plans per transition, keyed by (variable order, guard); they only depend on the structure
+        self._plan_cache: Dict[Transition, Dict[Tuple[Tuple[str, ...], Optional[str]], _CheckPlan]] = {}
+        # Last evaluated input requirements per transition:
+        # (context, input arcs, binding, types of the bound values, required by place)
+        self._required_cache: Dict[Transition, Tuple[EvaluationContext, Tuple, Dict[str, Any], Dict[str, Any],
+                                                     Dict[str, Dict[Any, int]]]] = {}
+
+    def _clear_caches(self):
+        self._binding_cache.clear()
+        self._signature_cache.clear()
+        self._plan_cache.clear()
+        self._required_cache.clear()
+
+    def _index_place(self, place: Place):
+        # setdefault: on duplicate names the first one wins, as with a linear scan
+        self._place_by_name.setdefault(place.name, place)
+
+    def _index_transition(self, transition: Transition):
+        self._transition_by_name.setdefault(transition.name, transition)
+
+    def _index_arc(self, arc: Arc):
+        if arc._src_is_place:
+            self._in_arcs.setdefault(arc.target, []).append(arc)
+        elif isinstance(arc.target, Place):
+            self._out_arcs.setdefault(arc.source, []).append(arc)
 
     def add_place(self, place: Place):
         self.places.append(place)
+        self._index_place(place)
+        self._clear_caches()
 
     def add_transition(self, transition: Transition):
         self.transitions.append(transition)
+        self._index_transition(transition)
+        self._clear_caches()
 
     def add_arc(self, arc: Arc):
         self.arcs.append(arc)
+        self._index_arc(arc)
+        self._clear_caches()
 
     def get_place_by_name(self, name: str) -> Optional[Place]:
-        for p in self.places:
-            if p.name == name:
-                return p
-        return None
+        return self._place_by_name.get(name)
 
     def get_transition_by_name(self, name: str) -> Optional[Transition]:
-        for t in self.transitions:
-            if t.name == name:
-                return t
-        return None
+        return self._transition_by_name.get(name)
 
     def get_input_arcs(self, t: Transition) -> List[Arc]:
-        return [a for a in self.arcs if isinstance(a.source, Place) and a.target == t]
+        return self._in_arcs.get(t, [])
 
     def get_output_arcs(self, t: Transition) -> List[Arc]:
-        return [a for a in self.arcs if a.source == t and isinstance(a.target, Place)]
+        return self._out_arcs.get(t, [])
 
     def is_enabled(self, t: Transition, marking: Marking, context: EvaluationContext,
                    binding: Optional[Dict[str, Any]] = None) -> bool:
@@ -326,127 +957,431 @@ class CPN:
                 return False
         return self._check_enabled_with_binding(t, marking, context, binding)
 
+    def enabled_transitions(self, marking: Marking,
+                            context: EvaluationContext) -> List[Tuple[Transition, Dict[str, Any]]]:
+        """
+        Returns every enabled transition together with a binding that enables it, in the order of
+        self.transitions. The ready tokens of each place are counted once for the whole sweep.
+        """
+        ready_counts = {}
+        enabled = []
+        for t in self.transitions:
+            binding = self._find_binding(t, marking, context, ready_counts)
+            if binding is not None:
+                enabled.append((t, binding))
+        return enabled
+
     def fire_transition(self, t: Transition, marking: Marking, context: EvaluationContext,
                         binding: Optional[Dict[str, Any]] = None):
         if binding is None:
             binding = self._find_binding(t, marking, context)
             if binding is None:
                 raise RuntimeError(f"No valid binding found for transition {t.name}.")
-        if not self._check_enabled_with_binding(t, marking, context, binding):
+        # Input arc values are evaluated once, for the enabling check and for the removal
+        required = self._input_requirements(t, context, binding)
+        if not self._check_enabled_with_binding(t, marking, context, binding, required):
             raise RuntimeError(f"Transition {t.name} is not enabled under the found binding.")
-
-        # Remove tokens
-        for arc in self.get_input_arcs(t):
-            values, _ = context.evaluate_arc(arc.expression, binding)
-            marking.remove_tokens(arc.source.name, values)
-
-        # Add tokens with proper timestamps
+        self._consume_and_produce(t, marking, context, binding, required)
+
+    def fire_transition_n(self, t: Transition, marking: Marking, context: EvaluationContext,
+                          binding: Optional[Dict[str, Any]] = None, n: int = 1):
+        """
+        Fire t n times in a row under the same binding, evaluating the arc expressions once.
+        The input tokens of all n firings must be ready up front (tokens produced by one
+        firing are not used by the next); otherwise nothing is fired and RuntimeError is raised.
+        """
+        if n <= 0:
+            return
+        if binding is None:
+            binding = self._find_binding(t, marking, context)
+            if binding is None:
+                raise RuntimeError(f"No valid binding found for transition {t.name}.")
+        required = self._input_requirements(t, context, binding)
+        if n > 1:
+            required = {place_name: {key: cnt * n for key, cnt in counts.items()}
+                        for place_name, counts in required.items()}
+        if not self._check_enabled_with_binding(t, marking, context, binding, required):
+            raise RuntimeError(f"Transition {t.name} is not enabled {n} times under the binding.")
+        self._consume_and_produce(t, marking, context, binding, required, n)
+
+    def _consume_and_produce(self, t: Transition, marking: Marking, context: EvaluationContext,
+                             binding: Dict[str, Any], required: Dict[str, Dict[Any, int]], n: int = 1):
+        # The firing itself, once enabling is checked: removes the required input tokens and adds
+        # n times the output arc values, the same tokens in the same order as n single firings
+        for place_name, counts in required.items():
+            marking._remove_counts(place_name, counts)
+
+        # Add tokens with proper timestamps, all values of an arc at once
         for arc in self.get_output_arcs(t):
-            values, arc_delay = context.evaluate_arc(arc.expression, binding)
-            for v in values:
-                place = arc.target
-                new_timestamp = marking.global_clock + t.transition_delay + arc_delay
-                if place.colorset.timed:
-                    marking.add_tokens(place.name, [v], timestamp=new_timestamp)
-                else:
-                    marking.add_tokens(place.name, [v], timestamp=0)
+            values, arc_delay = arc.evaluate_fast(context.env, binding)
+            if not values:
+                continue
+            place = arc.target
+            if place.colorset.timed:
+                timestamp = marking.global_clock + t.transition_delay + arc_delay
+            else:
+                timestamp = 0
+            marking.add_tokens(place.name, values * n if n > 1 else values, timestamp=timestamp)
 
     def _check_enabled_with_binding(self, t: Transition, marking: Marking, context: EvaluationContext,
-                                    binding: Dict[str, Any]) -> bool:
-        # Check input arcs and timestamps
-        for arc in self.get_input_arcs(t):
-            values, _ = context.evaluate_arc(arc.expression, binding)
-            place_marking = marking.get_multiset(arc.source.name)
-            # Check if we have enough ready tokens (timestamp <= global_clock)
-            for val in values:
-                ready_tokens = [tok for tok in place_marking.tokens if
-                                tok.value == val and tok.timestamp <= marking.global_clock]
-                if len(ready_tokens) < values.count(val):
-                    return False
+                                    binding: Dict[str, Any],
+                                    required_by_place: Optional[Dict[str, Dict[Any, int]]] = None) -> bool:
+        # Check input arcs and timestamps. Arcs sharing a place must be satisfied together.
+        if required_by_place is None:
+            required_by_place = self._input_requirements(t, context, binding)
+        for place_name, required in required_by_place.items():
+            if not _submultiset_ok(required, self._ready_counts(marking, place_name)):
+                return False
         if t.guard_expr:
-            if not context.evaluate_guard(t.guard_expr, binding):
+            if not context.evaluate_guard(t._compiled_guard(), binding):
                 return False    
         return True
 
-    def _find_binding(self, t: Transition, marking: Marking, context: EvaluationContext) -> Optional[Dict[str, Any]]:
-        variables = t.variables
+    def _input_requirements(self, t: Transition, context: EvaluationContext,
+                            binding: Dict[str, Any]) -> Dict[str, Dict[Any, int]]:
+        # The last result per transition is kept, so that is_enabled followed by fire_transition
+        # with the same binding evaluates the input arcs once. The result must not be modified.
+        # It is only kept when the input arcs read nothing but the binding (not the environment)
+        # and the bound values cannot change in place.
+        input_arcs = self.get_input_arcs(t)
+        arcs_key = tuple((arc.source.name, arc.expression) for arc in input_arcs)
+        cached = self._required_cache.get(t)
+        if (cached is not None and cached[0] is context and cached[1] == arcs_key and cached[2] == binding
+                and cached[3] == {var: _value_types(v) for var, v in binding.items()}):
+            return cached[4]
+        required = self._required_by_place(input_arcs, context, binding)
+        names = [arc._analyze()[0] for arc in input_arcs]
+        if (all(n is not None and n <= binding.keys() for n in names)
+                and all(_is_immutable_value(v) for v in binding.values())):
+            # Equal bindings can differ in the types of their values, so the types are kept too
+            self._required_cache[t] = (context, arcs_key, dict(binding),
+                                       {var: _value_types(v) for var, v in binding.items()}, required)
+        else:
+            self._required_cache.pop(t, None)
+        return required
+
+    @staticmethod
+    def _required_by_place(arcs: List[Arc], context: EvaluationContext,
+                           binding: Dict[str, Any]) -> Dict[str, Dict[Any, int]]:
+        # Plain dicts: arcs yield a handful of values, so Counter's construction overhead dominates
+        required: Dict[str, Dict[Any, int]] = {}
+        for arc in arcs:
+            values, _ = arc.evaluate_fast(context.env, binding)
+            if not values:
+                continue
+            counts = required.get(arc.source.name)
+            if counts is None:
+                required[arc.source.name] = _count_values(values)
+            else:
+                _count_values(values, counts)
+        return required
+
+    def _cached_ready_counts(self, marking: Marking, place_name: str,
+                             ready_counts: Dict[str, Dict[Any, int]]) -> Dict[Any, int]:
+        ready = ready_counts.get(place_name)
+        if ready is None:
+            ready = ready_counts[place_name] = self._ready_counts(marking, place_name)
+        return ready
+
+    @staticmethod
+    def _ready_counts(marking: Marking, place_name: str) -> Dict[Any, int]:
+        # Ready tokens (timestamp <= global_clock) of the place, counted per value key
+        return marking._ready_counts(place_name)
+
+    def _variable_domains(self, t: Transition, marking: Marking, ready_counts: Dict[str, Dict[Any, int]]
+                          ) -> Tuple[Dict[str, List[Any]], Optional[Dict[Any, int]]]:
+        """
+        Candidate values for each variable of t, and the token limits of the search.
+
+        Each variable binds a distinct ready token of the token pool, which holds the ready tokens
+        of the place of every input arc (a place is counted once per arc). A variable that appears
+        as a token of an input arc (e.g. `x` or `[x, y]`) can only take the values of that arc's
+        place; any other variable ranges over the values of the whole pool. As several variables
+        cannot bind the same token, a value can be taken by at most as many variables as the pool
+        has tokens of it: the limits map each value key to that number, or are None when no value
+        is short of tokens for all the variables. The search takes a value from them per bound
+        variable. The ready counts of the input places are stored in ready_counts for the search.
+        """
         input_arcs = self.get_input_arcs(t)
 
-        # Gather candidate tokens from input places that are ready
-        token_pool = []
+        # Distinct ready values per input place (keyed by _value_key), and the token pool
+        place_values: Dict[str, Dict[Any, int]] = {}
+        pool: Dict[Any, int] = {}
         for arc in input_arcs:
-            place_tokens = marking.get_multiset(arc.source.name).tokens
-            candidate_tokens = [tok for tok in place_tokens if tok.timestamp <= marking.global_clock]
-            token_pool.extend(candidate_tokens)
-
-        return self._backtrack_binding(variables, token_pool, context, t, marking, {}, set())
-
-    def _backtrack_binding(self, variables: List[str], token_pool: List[Token], context: EvaluationContext,
-                           t: Transition, marking: Marking, partial_binding: Dict[str, Any],
-                           used_indices: set) -> Optional[Dict[str, Any]]:
-        if not variables:
-            # Check if this binding actually enables the transition
-            if self._check_enabled_with_binding(t, marking, context, partial_binding):
-                return partial_binding
-            return None
+            place_name = arc.source.name
+            values = place_values.get(place_name)
+            if values is None:
+                values = place_values[place_name] = self._cached_ready_counts(marking, place_name, ready_counts)
+            for key, cnt in values.items():
+                pool[key] = pool.get(key, 0) + cnt
+
+        domains = {}
+        for var in t.variables:
+            domain = None
+            for arc in input_arcs:
+                if var in arc._analyze()[1]:
+                    values = place_values[arc.source.name]
+                    if domain is None:
+                        domain = values
+                    else:
+                        domain = {k: v for k, v in domain.items() if k in values}
+            domains[var] = [_key_value(key) for key in (pool if domain is None else domain)]
+        num_vars = len(t.variables)
+        limits = pool if num_vars > 1 and any(cnt < num_vars for cnt in pool.values()) else None
+        return domains, limits
+
+    def _search_order(self, t: Transition, domains: Dict[str, List[Any]]) -> List[str]:
+        # Most constrained variable first; the sort is stable, so ties keep the declared order
+        return sorted(t.variables, key=lambda v: len(domains[v]))
+
+    def _pruning_plan(self, t: Transition, order: List[str]) -> _CheckPlan:
+        # The plan is fixed for a given transition, variable order and guard, so it is built once
+        key = (tuple(order), t.guard_expr)
+        plans = self._plan_cache.setdefault(t, {})
+        plan = plans.get(key)
+        if plan is None:
+            plan = plans[key] = self._build_pruning_plan(t, order)
+        return plan
+
+    def _build_pruning_plan(self, t: Transition, order: List[str]) -> _CheckPlan:
+        """
+        For a variable order, returns for each depth d (number of variables assigned) the checks
+        that become decidable once the first d variables are bound: the input arcs, and the guard
+        as the tuple of variables it is called with (None if it is not checked at that depth).
+        Arcs drawing from the same place are checked together, at the depth of the last of them.
+        Expressions that cannot be analyzed are checked at the leaf.
+        """
+        depth_of = {var: i + 1 for i, var in enumerate(order)}
+        leaf = len(order)
+
+        def ready_depth(names: Optional[FrozenSet[str]]) -> int:
+            if names is None:
+                return leaf
+            return max((depth_of[n] for n in names if n in depth_of), default=0)
+
+        place_depth: Dict[str, int] = {}
+        input_arcs = self.get_input_arcs(t)
+        for arc in input_arcs:
+            place_name = arc.source.name
+            place_depth[place_name] = max(place_depth.get(place_name, 0), ready_depth(arc._analyze()[0]))
 
-        var = variables[0]
-        for i, tok in enumerate(token_pool):
-            if i in used_indices:
+        plan = [([], None) for _ in range(leaf + 1)]
+        for arc in input_arcs:
+            plan[place_depth[arc.source.name]][0].append(arc)
+        if t.guard_expr:
+            names = t._guard_analysis()
+            params = tuple(t.variables) if names is None else tuple(v for v in t.variables if v in names)
+            depth = ready_depth(names)
+            plan[depth] = (plan[depth][0], params)
+        return plan
+
+    def _partial_ok(self, checks: Tuple[List[Arc], Optional[Tuple[str, ...]]], t: Transition, marking: Marking,
+                    context: EvaluationContext, binding: Dict[str, Any],
+                    ready_counts: Dict[str, Dict[Any, int]]) -> bool:
+        arcs, guard_params = checks
+        if len(arcs) == 1:
+            # Common case of a single arc to check: no grouping by place needed
+            arc = arcs[0]
+            values, _ = arc.evaluate_fast(context.env, binding)
+            if values:
+                ready = self._cached_ready_counts(marking, arc.source.name, ready_counts)
+                if len(values) == 1:
+                    # One token (e.g. "x"): a single lookup, nothing to count
+                    if not ready.get(_value_key(values[0])):
+                        return False
+                elif not _submultiset_ok(_count_values(values), ready):
+                    return False
+        else:
+            for place_name, required in self._required_by_place(arcs, context, binding).items():
+                if not _submultiset_ok(required, self._cached_ready_counts(marking, place_name, ready_counts)):
+                    return False
+        if guard_params is not None:
+            guard = context.guard_function(t.guard_expr, guard_params)
+            return guard(*[binding[v] for v in guard_params])
+        return True
+
+    def _search_signature(self, t: Transition) -> Optional[Tuple]:
+        """
+        What a binding search for t depends on besides the marking: its guard, variables and input
+        arcs. None if the guard or an input arc references any other name (the environment of the
+        context, builtins, ...), as the search may then give a different result on the same marking.
+        """
+        input_arcs = self.get_input_arcs(t)
+        signature = (t.guard_expr, tuple(t.variables), tuple((arc.source.name, arc.expression) for arc in input_arcs))
+        cached = self._signature_cache.get(t)
+        if cached is None or cached[0] != signature:
+            variables = set(t.variables)
+            names = [arc._analyze()[0] for arc in input_arcs]
+            if t.guard_expr:
+                names.append(t._guard_analysis())
+            cached = self._signature_cache[t] = (signature, all(n is not None and n <= variables for n in names))
+        return signature if cached[1] else None
+
+    def _find_binding(self, t: Transition, marking: Marking, context: EvaluationContext,
+                      ready_counts: Optional[Dict[str, Dict[Any, int]]] = None) -> Optional[Dict[str, Any]]:
+        # Repeated probes of unchanged input places (e.g. is_enabled followed by fire_transition)
+        # reuse the previous result, including a negative one. Only searches that depend on nothing
+        # but the input tokens are cached, and only when those tokens cannot change in place.
+        signature = self._search_signature(t)
+        stamps = None
+        if signature is not None:
+            stamps = tuple(marking._marking.get(arc.source.name, _EMPTY_MULTISET)._stamp
+                           for arc in self.get_input_arcs(t))
+            cached = self._binding_cache.get(t)
+            if (cached is not None and cached[0] == stamps and cached[1] == marking.global_clock
+                    and cached[2] is context and cached[3] == signature):
+                binding = cached[4]
+                return None if binding is None else dict(binding)
+        binding = self._search_binding(t, marking, context, {} if ready_counts is None else ready_counts)
+        if stamps is not None and all(_is_immutable_value(key)
+                                      for arc in self.get_input_arcs(t)
+                                      for key in marking._ready_counts(arc.source.name)):
+            self._binding_cache[t] = (stamps, marking.global_clock, context, signature, binding)
+        else:
+            self._binding_cache.pop(t, None)
+        return None if binding is None else dict(binding)
+
+    def _search_binding(self, t: Transition, marking: Marking, context: EvaluationContext,
+                        ready_counts: Dict[str, Dict[Any, int]]) -> Optional[Dict[str, Any]]:
+        # The first binding in search order (see _variable_domains and _search_order). The enabling
+        # bindings are the same as binding each variable to a distinct pool token in declared order,
+        # but which of them comes first may differ from such a token-by-token search.
+        # A variable taken from the tokens of an empty place has no candidate value
+        for arc in self.get_input_arcs(t):
+            if not marking.get_multiset(arc.source.name)._buckets and not arc._analyze()[1].isdisjoint(t.variables):
+                return None
+        domains, limits = self._variable_domains(t, marking, ready_counts)
+        if any(not d for d in domains.values()):
+            return None
+        order = self._search_order(t, domains)
+        plan = self._pruning_plan(t, order)
+        if not self._partial_ok(plan[0], t, marking, context, {}, ready_counts):
+            return None
+        if self._leaf_checks_only(plan):
+            return next(self._iter_product_bindings(order, domains, context, t, marking, plan, ready_counts,
+                                                    limits), None)
+        return self._backtrack_binding(order, 0, domains, context, t, marking, {}, plan, ready_counts, limits)
+
+    @staticmethod
+    def _leaf_checks_only(plan: _CheckPlan) -> bool:
+        # True if there are variables and nothing can be checked before all of them are bound
+        return len(plan) > 1 and not any(arcs or guard_params is not None for arcs, guard_params in plan[1:-1])
+
+    def _iter_product_bindings(self, variables: List[str], domains: Dict[str, List[Any]],
+                               context: EvaluationContext, t: Transition, marking: Marking,
+                               plan: _CheckPlan, ready_counts: Dict[str, Dict[Any, int]],
+                               limits: Optional[Dict[Any, int]] = None):
+        # Without intermediate pruning the search is a plain cartesian product of the domains
+        checks = plan[-1]
+        binding = {}
+        for combo in itertools.product(*(domains[v] for v in variables)):
+            if limits is not None and not _submultiset_ok(_count_values(combo), limits):
                 continue
-            # Try assigning tok.value to var
-            new_binding = dict(partial_binding)
-            new_binding[var] = tok.value
-            used_indices.add(i)
-            res = self._backtrack_binding(variables[1:], token_pool, context, t, marking, new_binding, used_indices)
+            binding.update(zip(variables, combo))
+            if self._partial_ok(checks, t, marking, context, binding, ready_counts):
+                yield {v: binding[v] for v in t.variables}
+
+    def _backtrack_binding(self, variables: List[str], depth: int, domains: Dict[str, List[Any]],
+                           context: EvaluationContext, t: Transition, marking: Marking,
+                           partial_binding: Dict[str, Any], plan: _CheckPlan,
+                           ready_counts: Dict[str, Dict[Any, int]],
+                           limits: Optional[Dict[Any, int]] = None) -> Optional[Dict[str, Any]]:
+        # partial_binding (and limits) are scratch state: assigned before descending, undone afterwards
+        if depth == len(variables):
+            # Every arc and the guard were already checked on the way down
+            return {v: partial_binding[v] for v in t.variables}
+
+        var = variables[depth]
+        checks = plan[depth + 1]
+        res = None
+        for value in domains[var]:
+            if limits is not None:
+                # The variable takes one of the remaining tokens of its value
+                key = _value_key(value)
+                if not limits[key]:
+                    continue
+                limits[key] -= 1
+            partial_binding[var] = value
+            # Reject as soon as an arc or the guard with all its variables bound fails
+            if self._partial_ok(checks, t, marking, context, partial_binding, ready_counts):
+                res = self._backtrack_binding(variables, depth + 1, domains, context, t, marking,
+                                              partial_binding, plan, ready_counts, limits)
+            if limits is not None:
+                limits[key] += 1
             if res is not None:
                 return res
-            used_indices.remove(i)
+        partial_binding.pop(var, None)
         return None
 
-    def _find_all_bindings(self, t: Transition, marking: Marking, context: EvaluationContext) -> List[Dict[str, Any]]:
-        variables = t.variables
-        input_arcs = self.get_input_arcs(t)
-
-        # Gather candidate tokens from input places that are ready
-        token_pool = []
-        for arc in input_arcs:
-            place_tokens = marking.get_multiset(arc.source.name).tokens
-            candidate_tokens = [tok for tok in place_tokens if tok.timestamp <= marking.global_clock]
-            token_pool.extend(candidate_tokens)
-
+    def _find_all_bindings(self, t: Transition, marking: Marking, context: EvaluationContext,
+                           ready_counts: Optional[Dict[str, Dict[Any, int]]] = None) -> List[Dict[str, Any]]:
+        # Each enabling binding is listed once, in search order. (A token-by-token search lists a
+        # binding once per combination of tokens it can be taken from, in token order.)
+        # ready_counts can be shared by the searches of several transitions on the same marking and clock
+        if ready_counts is None:
+            ready_counts = {}
+        domains, limits = self._variable_domains(t, marking, ready_counts)
         solutions = []
-        self._backtrack_all_bindings(variables, token_pool, context, t, marking, {}, set(), solutions)
+        if all(domains.values()):
+            order = self._search_order(t, domains)
+            plan = self._pruning_plan(t, order)
+            if self._partial_ok(plan[0], t, marking, context, {}, ready_counts):
+                if self._leaf_checks_only(plan):
+                    solutions.extend(self._iter_product_bindings(order, domains, context, t, marking, plan,
+                                                                 ready_counts, limits))
+                else:
+                    self._backtrack_all_bindings(order, 0, domains, context, t, marking, {}, solutions, plan,
+                                                 ready_counts, limits)
         return solutions
 
-    def _backtrack_all_bindings(self, variables: List[str], token_pool: List[Token], context: EvaluationContext,
-                                t: Transition, marking: Marking, partial_binding: Dict[str, Any],
-                                used_indices: set, solutions: List[Dict[str, Any]]):
-        if not variables:
-            # Check if this binding actually enables the transition
-            if self._check_enabled_with_binding(t, marking, context, partial_binding):
-                solutions.append(dict(partial_binding))
+    def _backtrack_all_bindings(self, variables: List[str], depth: int, domains: Dict[str, List[Any]],
+                                context: EvaluationContext, t: Transition, marking: Marking,
+                                partial_binding: Dict[str, Any], solutions: List[Dict[str, Any]],
+                                plan: _CheckPlan, ready_counts: Dict[str, Dict[Any, int]],
+                                limits: Optional[Dict[Any, int]] = None):
+        if depth == len(variables):
+            # Every arc and the guard were already checked on the way down
+            solutions.append({v: partial_binding[v] for v in t.variables})
             return
 
-        var = variables[0]
-        for i, tok in enumerate(token_pool):
-            if i in used_indices:
-                continue
-            new_binding = dict(partial_binding)
-            new_binding[var] = tok.value
-            used_indices.add(i)
-            self._backtrack_all_bindings(variables[1:], token_pool, context, t, marking, new_binding, used_indices,
-                                         solutions)
-            used_indices.remove(i)
+        var = variables[depth]
+        checks = plan[depth + 1]
+        for value in domains[var]:
+            if limits is not None:
+                key = _value_key(value)
+                if not limits[key]:
+                    continue
+                limits[key] -= 1
+            partial_binding[var] = value
+            if self._partial_ok(checks, t, marking, context, partial_binding, ready_counts):
+                self._backtrack_all_bindings(variables, depth + 1, domains, context, t, marking, partial_binding,
+                                             solutions, plan, ready_counts, limits)
+            if limits is not None:
+                limits[key] += 1
+        partial_binding.pop(var, None)
 
     def advance_global_clock(self, marking: Marking):
-        future_ts = []
+        clock = marking.global_clock
+        # Timestamps are sorted per bucket: the earliest future one follows the ready ones
+        next_ts = None
         for ms in marking._marking.values():
-            for tok in ms.tokens:
-                if tok.timestamp > marking.global_clock:
-                    future_ts.append(tok.timestamp)
-        if future_ts:
-            marking.global_clock = min(future_ts)
+            for stamps in ms._buckets.values():
+                if stamps[-1] > clock:
+                    ts = stamps[bisect.bisect_right(stamps, clock)]
+                    if next_ts is None or ts < next_ts:
+                        next_ts = ts
+        if next_ts is not None:
+            marking.global_clock = next_ts
+
+    def __getstate__(self):
+        # Indexes and caches (which hold code and contexts) are rebuilt on unpickling
+        return {"places": self.places, "transitions": self.transitions, "arcs": self.arcs}
+
+    def __setstate__(self, state):
+        self.places = state["places"]
+        self.transitions = state["transitions"]
+        self.arcs = state["arcs"]
+        self._build_indexes()
 
     def __repr__(self):
         places_str = "\n    ".join(repr(p) for p in self.places)
@@ -463,6 +1398,7 @@ class CPN:
         result.places = self.places[:]
         result.transitions = self.transitions[:]
         result.arcs = self.arcs[:]
+        result._build_indexes()
         return result
 
     def __deepcopy__(self, memo):
@@ -472,6 +1408,7 @@ class CPN:
         result.places = copy.deepcopy(self.places, memo)
         result.transitions = copy.deepcopy(self.transitions, memo)
         result.arcs = copy.deepcopy(self.arcs, memo)
+        result._build_indexes()
         return result
 
 
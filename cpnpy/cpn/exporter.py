@@ -65,6 +65,43 @@ def find_all_colorsets(cpn: CPN) -> Set[ColorSet]:
 
     return all_unique_colorsets
 
+def encode_json(data: Any) -> bytes:
+    """ Encodes data as the exported JSON file content (json.dumps with indent=2, UTF-8 bytes). """
+    return json.dumps(data, indent=2).encode("utf-8")
+
+# -----------------------------------------------------------------------------------
+# 'colset' emitters, keyed by ColorSet class: (cs, name, timed_str, define) -> definition.
+# define(cs) names (and defines first) a constituent colorset.
+# -----------------------------------------------------------------------------------
+_COLORSET_EMITTERS = {
+    IntegerColorSet: lambda cs, name, timed, define: f"colset {name} = int{timed};",
+    RealColorSet: lambda cs, name, timed, define: f"colset {name} = real{timed};",
+    StringColorSet: lambda cs, name, timed, define: f"colset {name} = string{timed};",
+    BoolColorSet: lambda cs, name, timed, define: f"colset {name} = bool{timed};",
+    UnitColorSet: lambda cs, name, timed, define: f"colset {name} = unit{timed};",
+    IntInfColorSet: lambda cs, name, timed, define: f"colset {name} = intinf{timed};",
+    TimeColorSet: lambda cs, name, timed, define: f"colset {name} = time{timed};",
+    DictionaryColorSet: lambda cs, name, timed, define: f"colset {name} = dict{timed};",
+    EnumeratedColorSet: lambda cs, name, timed, define:
+        "colset {} = {{ {} }}{};".format(name, ", ".join(f"'{v}'" for v in cs.values), timed),
+    # *** Constituents are defined (left to right) before the composite itself ***
+    ProductColorSet: lambda cs, name, timed, define:
+        f"colset {name} = product({define(cs.cs1)}, {define(cs.cs2)}){timed};",
+    ListColorSet: lambda cs, name, timed, define: f"colset {name} = list {define(cs.element_cs)}{timed};",
+}
+
+
+def _colorset_emitter(cs_type: type):
+    """ Returns the emitter for a ColorSet class, falling back to its closest known base class. """
+    emit = _COLORSET_EMITTERS.get(cs_type)
+    if emit is None:
+        for base in cs_type.__mro__[1:]:
+            emit = _COLORSET_EMITTERS.get(base)
+            if emit is not None:
+                _COLORSET_EMITTERS[cs_type] = emit
+                break
+    return emit
+
 # -----------------------------------------------------------------------------------
 # Exporter functions (Modified)
 # -----------------------------------------------------------------------------------
@@ -99,8 +136,10 @@ def generate_color_set_definitions(cpn: CPN):
     def define_colorset(cs: ColorSet) -> str:
         nonlocal generated_name_counter
         # If this specific ColorSet instance is already defined, return its assigned name
-        if cs in colorset_to_name:
-            return colorset_to_name[cs]
+        # (ColorSet keeps identity hashing, so this is a single identity-keyed lookup)
+        existing_name = colorset_to_name.get(cs)
+        if existing_name is not None:
+            return existing_name
 
         # --- Determine the name for this colorset ---
         assigned_name = None
@@ -118,44 +157,15 @@ def generate_color_set_definitions(cpn: CPN):
 
         # --- Generate the definition string ---
         timed_str = " timed" if cs.timed else ""
-        base_def = ""
-
-        # Handle each known color set subclass
-        if isinstance(cs, IntegerColorSet):
-            base_def = f"colset {assigned_name} = int{timed_str};"
-        elif isinstance(cs, RealColorSet):
-            base_def = f"colset {assigned_name} = real{timed_str};"
-        elif isinstance(cs, StringColorSet):
-            base_def = f"colset {assigned_name} = string{timed_str};"
-        elif isinstance(cs, BoolColorSet):
-            base_def = f"colset {assigned_name} = bool{timed_str};"
-        elif isinstance(cs, UnitColorSet):
-            base_def = f"colset {assigned_name} = unit{timed_str};"
-        elif isinstance(cs, IntInfColorSet):
-            base_def = f"colset {assigned_name} = intinf{timed_str};"
-        elif isinstance(cs, TimeColorSet):
-            base_def = f"colset {assigned_name} = time{timed_str};"
-        elif isinstance(cs, DictionaryColorSet):
-            base_def = f"colset {assigned_name} = dict{timed_str};"
-        elif isinstance(cs, EnumeratedColorSet):
-            enumerations = ", ".join(f"'{v}'" for v in cs.values)
-            base_def = f"colset {assigned_name} = {{ {enumerations} }}{timed_str};"
-        elif isinstance(cs, ProductColorSet):
-            # *** Recursive call ensures constituents are defined first ***
-            cs1_name = define_colorset(cs.cs1)
-            cs2_name = define_colorset(cs.cs2)
-            base_def = f"colset {assigned_name} = product({cs1_name}, {cs2_name}){timed_str};"
-        elif isinstance(cs, ListColorSet):
-            # *** Recursive call ensures constituent is defined first ***
-            sub_name = define_colorset(cs.element_cs)
-            base_def = f"colset {assigned_name} = list {sub_name}{timed_str};"
-        else:
+
+        emit = _colorset_emitter(type(cs))
+        if emit is None:
             # Clean up potentially assigned name if we error out
             if assigned_name in used_definition_names:
                  used_definition_names.remove(assigned_name)
-            if cs in colorset_to_name:
-                 del colorset_to_name[cs]
+            colorset_to_name.pop(cs, None)
             raise ValueError(f"Unknown ColorSet type during export: {type(cs)}")
+        base_def = emit(cs, assigned_name, timed_str, define_colorset)
 
         # Add the definition to the ordered dictionary *after* constituents are processed
         name_to_def[assigned_name] = base_def
@@ -205,20 +215,15 @@ def export_cpn_to_json(
     # Transitions (also gather arcs here)
     transitions_json = []
     for t in cpn.transitions:
-        in_arcs = []
-        out_arcs = []
-        # It's more efficient to iterate arcs once and check source/target type
-        for arc in cpn.arcs:
-            if arc.target == t and isinstance(arc.source, Place):
-                in_arcs.append({
-                    "place": arc.source.name,
-                    "expression": arc.expression
-                })
-            elif arc.source == t and isinstance(arc.target, Place):
-                out_arcs.append({
-                    "place": arc.target.name,
-                    "expression": arc.expression
-                })
+        # The net already indexes its arcs per transition, in insertion order
+        in_arcs = [
+            {"place": arc.source.name, "expression": arc.expression}
+            for arc in cpn.get_input_arcs(t)
+        ]
+        out_arcs = [
+            {"place": arc.target.name, "expression": arc.expression}
+            for arc in cpn.get_output_arcs(t)
+        ]
 
         t_json = {
             "name": t.name,
@@ -245,15 +250,13 @@ def export_cpn_to_json(
             continue
 
         # Extract tokens and timestamps correctly from Multiset
-        tokens = [tok.value for tok in ms.tokens]
-        timestamps = [tok.timestamp for tok in ms.tokens]
+        pairs = list(ms.pairs())
+        marking_data = {"tokens": [value for value, _ in pairs]}
 
         # Only include timestamps if the place's colorset is timed OR if any token has a non-zero timestamp
-        include_timestamps = place.colorset.timed or any(ts != 0 for ts in timestamps)
-
-        marking_data = {"tokens": tokens}
-        if include_timestamps:
-             marking_data["timestamps"] = timestamps
+        # (the timestamp list is only built when it is actually exported)
+        if place.colorset.timed or any(ts != 0 for _, ts in pairs):
+             marking_data["timestamps"] = [ts for _, ts in pairs]
 
         initial_marking[pname] = marking_data
 
@@ -303,8 +306,9 @@ def export_cpn_to_json(
     try:
          # Ensure directory exists
          #os.makedirs(os.path.dirname(output_json_path), exist_ok=True)
-         with open(output_json_path, "w") as f:
-             json.dump(final_json, f, indent=2)
+         # Encode in one go: json.dump would issue a write per JSON token
+         with open(output_json_path, "wb") as f:
+             f.write(encode_json(final_json))
     except Exception as e:
         import traceback
         traceback.print_exc()
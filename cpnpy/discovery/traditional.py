@@ -9,18 +9,6 @@ from typing import Tuple
 from cpnpy.cpn.cpn_imp import *
 
 
-def last_non_null(series):
-    """
-    Returns the last non-null value of a pandas Series.
-    If all are null, returns None (or np.nan, depending on preference).
-    """
-    non_null = series.dropna()
-    if not non_null.empty:
-        return non_null.iloc[-1]
-    else:
-        return None  # or np.nan
-
-
 def apply(log: EventLog, parameters: Optional[Dict[str, Any]] = None) -> Tuple[CPN, Marking, EvaluationContext]:
     """
     Applies a process discovery algorithm to the input event log, optionally discovers guards for transitions
@@ -155,22 +143,29 @@ def apply(log: EventLog, parameters: Optional[Dict[str, Any]] = None) -> Tuple[C
                 cpn.add_arc(Arc(dict_transitions[trans.name], dict_places[arc.target.name], "C"))
 
     marking = Marking()
-    for p in im:
-        if original_log_cases_in_im:
-            all_cases = set(log["case:concept:name"].unique())
-            all_cases = set(random.sample(all_cases, min(len(all_cases), num_simulated_cases)))
-            result_dict = log[log["case:concept:name"].isin(all_cases)].groupby("case:concept:name").agg(last_non_null).to_dict(orient='index')
-
-            lst = []
-            for c, vv in result_dict.items():
-                lst.append(frozendict({k: v for k, v in vv.items() if k in original_case_attributes}))
+    if original_log_cases_in_im:
+        all_cases = set(log["case:concept:name"].unique())
+        # every place of the initial marking samples its own cases
+        sampled_cases = {p: set(random.sample(list(all_cases), min(len(all_cases), num_simulated_cases)))
+                         for p in im}
+        # the case attributes are computed once, for all the sampled cases together;
+        # only the requested case attributes are scanned, the case id itself becomes the index
+        columns = ["case:concept:name"] + [a for a in log.columns if a in original_case_attributes and a != "case:concept:name"]
+        cases = set().union(*sampled_cases.values())
+        # last() skips nulls: each case gets its last known value per column, without a Python call per group
+        # (an attribute without any known value for the case stays NaN)
+        result_dict = log.loc[log["case:concept:name"].isin(cases), columns].groupby("case:concept:name").last() \
+            .to_dict(orient='index')
+        case_tokens = {c: frozendict(vv) for c, vv in result_dict.items()}
+
+        for p in im:
             marking.set_tokens(dict_places[p.name].name,
-                               lst)
-        else:
-
-            marking.set_tokens(dict_places[p.name].name,
-                               [frozendict({"case:concept:name": "CASE_" + str(i + 1)}) for i in
-                                range(num_simulated_cases)])
+                               [token for c, token in case_tokens.items() if c in sampled_cases[p]])
+    else:
+        # the artificial cases are the same for every place of the initial marking, so they are built once
+        tokens = [frozendict({"case:concept:name": "CASE_" + str(i + 1)}) for i in range(num_simulated_cases)]
+        for p in im:
+            marking.set_tokens(dict_places[p.name].name, tokens)
 
     code = ""
     if enable_timing_discovery:
@@ -10,7 +10,7 @@ def cpn_to_graphviz(cpn: CPN, marking: Marking) -> graphviz.Digraph:
     # 1. Add Place nodes
     for place in cpn.places:
         place_id = f"place_{place.name}"
-        num_tokens = len(marking.get_multiset(place.name).tokens)
+        num_tokens = len(marking.get_multiset(place.name))
         label = f"{place.name}\\n{repr(place.colorset)}\\nTokens: {num_tokens}"
         dot.node(place_id, label=label, shape="ellipse", style="filled", color="#D3E4CD")
 
@@ -3,7 +3,7 @@ import json
 
 # Use your existing importer/exporter from cpnpy.cpn
 from cpnpy.cpn.importer import import_cpn_from_json
-from cpnpy.cpn.exporter import export_cpn_to_json
+from cpnpy.cpn.exporter import export_cpn_to_json, encode_json
 from cpnpy.cpn.colorsets import ColorSetParser
 
 
@@ -129,20 +129,23 @@ def export_cpn_ui():
     if st.button("Export CPN in JSON"):
         try:
             # exporter returns a dict representing the JSON structure
-            export_cpn_to_json(
+            final_json = export_cpn_to_json(
                 cpn=cpn,
                 marking=marking,
                 context=context,
                 output_json_path=filename,  # not actually writing to disk except for references
                 output_py_path=None         # or "exported_user_code.py", etc.
             )
+            if final_json is None:
+                raise RuntimeError(f"could not write '{filename}'")
 
-            exported_str = open(filename, "r").read()
+            # Same bytes as the exported file, without reading it back
+            exported_bytes = encode_json(final_json)
 
             # Provide a download button
             st.download_button(
                 label="Download JSON",
-                data=exported_str,
+                data=exported_bytes,
                 file_name=filename,
                 mime="application/json"
             )
@@ -34,8 +34,4 @@ def get_enabled_transitions(cpn: CPN, marking: Marking, context: EvaluationConte
     """
     Return a list of currently enabled transitions' names.
     """
-    enabled = []
-    for t in cpn.transitions:
-        if cpn.is_enabled(t, marking, context):
-            enabled.append(t.name)
-    return enabled
+    return [t.name for t, _ in cpn.enabled_transitions(marking, context)]
@@ -31,13 +31,8 @@ def simulate_cpn_to_ocel(cpn: CPN, initial_marking: Marking, context: Evaluation
 
     # Run simulation until no transition is enabled
     while True:
-        enabled_transitions = []
-        # Check which transitions are enabled
-        transitions = list(cpn.transitions)
-        random.shuffle(transitions)
-        for t in transitions:
-            if cpn.is_enabled(t, marking, context):
-                enabled_transitions.append(t)
+        # Check which transitions are enabled, each with the binding that enables it
+        enabled_transitions = cpn.enabled_transitions(marking, context)
 
         if not enabled_transitions:
             # No transitions enabled, try to advance time
@@ -51,13 +46,7 @@ def simulate_cpn_to_ocel(cpn: CPN, initial_marking: Marking, context: Evaluation
                 continue
 
         # Fire an arbitrary enabled transition
-        t = enabled_transitions[0]
-
-        # Determine the actual binding used to fire
-        binding = cpn._find_binding(t, marking, context)
-        if binding is None:
-            # If no binding found, skip (should be rare)
-            break
+        t, binding = random.choice(enabled_transitions)
 
         # Add a minuscule increment (1 microsecond per event) to the event timestamp
         event_timestamp = pd.to_datetime(marking.global_clock, unit='s', utc=True) + pd.to_timedelta(event_counter,
@@ -71,7 +60,7 @@ def simulate_cpn_to_ocel(cpn: CPN, initial_marking: Marking, context: Evaluation
 
         # For input arcs
         for arc in cpn.get_input_arcs(t):
-            values, _ = context.evaluate_arc(arc.expression, binding)
+            values, _ = arc.evaluate_fast(context.env, binding)
             otype = get_object_type_from_colorset(arc.source)  # derive from source place's color set
             for v in values:
                 obj_id = make_object_id(v)
@@ -82,7 +71,7 @@ def simulate_cpn_to_ocel(cpn: CPN, initial_marking: Marking, context: Evaluation
 
         # For output arcs
         for arc in cpn.get_output_arcs(t):
-            values, arc_delay = context.evaluate_arc(arc.expression, binding)
+            values, arc_delay = arc.evaluate_fast(context.env, binding)
             otype = get_object_type_from_colorset(arc.target)  # derive from target place's color set
             for v in values:
                 obj_id = make_object_id(v)
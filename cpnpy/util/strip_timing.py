@@ -1,4 +1,5 @@
 import copy
+from cpnpy.cpn.cpn_imp import Multiset
 
 
 def strip_timed_information(cpn, marking):
@@ -23,9 +24,8 @@ def strip_timed_information(cpn, marking):
             a.expression = a.expression.split('@+')[0].strip()
 
     # 4. Remove all timestamps from tokens in the marking
-    for ms in marking_copy._marking.values():
-        for tok in ms.tokens:
-            tok.timestamp = 0
+    for place_name, ms in marking_copy._marking.items():
+        marking_copy._marking[place_name] = Multiset(value for value, _ in ms.pairs())
 
     # Reset the global clock
     marking_copy.global_clock = 0
@@ -0,0 +1,83 @@
+import pytest
+
+from cpnpy.cpn.cpn_imp import *
+
+
+def _string_net():
+    cs = ColorSetParser().parse_definitions("colset S = string;")["S"]
+    p = Place("P", cs)
+    t = Transition("T", variables=["x"])
+    cpn = CPN()
+    cpn.add_place(p)
+    cpn.add_transition(t)
+    cpn.add_arc(Arc(p, t, 'f"{x}"'))
+    return cpn, t
+
+
+def test_input_requirements_tell_equal_values_of_other_types_apart():
+    cpn, t = _string_net()
+    marking = Marking()
+    marking.set_tokens("P", ["1", "True"])
+    context = EvaluationContext()
+
+    assert cpn.is_enabled(t, marking, context, binding={"x": 1})
+    # True == 1, but the arc gives "True" for it, not "1"
+    cpn.fire_transition(t, marking, context, binding={"x": True})
+    assert [tok.value for tok in marking.get_multiset("P").tokens] == ["1"]
+
+
+def test_absent_place_multiset_is_read_only():
+    marking, other = Marking(), Marking()
+    empty = marking.get_multiset("absent")
+    with pytest.raises(TypeError):
+        empty.tokens = [1]
+    with pytest.raises(TypeError):
+        empty.add(1)
+    with pytest.raises(TypeError):
+        empty.extend([1])
+    assert len(other.get_multiset("absent")) == 0
+    empty.remove(1, count=0)
+
+    # Copies can be changed, and tokens are added through the marking
+    copied = copy.copy(empty)
+    copied.add(1)
+    marking.add_tokens("absent", [2])
+    assert [tok.value for tok in copied.tokens] == [1]
+    assert [tok.value for tok in marking.get_multiset("absent").tokens] == [2]
+    assert len(other.get_multiset("absent")) == 0
+
+
+def test_guard_memo_tells_equal_nested_values_of_other_types_apart():
+    context = EvaluationContext()
+    guard = context.guard_function('f"{x[0]}" == "True"', ("x",))
+
+    assert not guard((1, "a"))
+    assert guard((True, "a"))
+
+
+def test_remove_nothing_of_an_absent_value():
+    ms = Multiset([1, 1])
+    ms.remove(2, count=0)
+    ms.remove(1, count=0)
+    assert [tok.value for tok in ms.tokens] == [1, 1]
+    with pytest.raises(ValueError):
+        ms.remove(2)
+
+
+def test_fire_transition_n_matches_single_firings():
+    cpn, t = _string_net()
+    cs = ColorSetParser().parse_definitions("colset T = string timed;")["T"]
+    out = Place("Q", cs)
+    cpn.add_place(out)
+    cpn.add_arc(Arc(t, out, '[x, x + "!"] @+ 2'))
+    context = EvaluationContext()
+
+    once, n_times = Marking(), Marking()
+    for marking in (once, n_times):
+        marking.set_tokens("P", ["a", "a", "a"])
+    cpn.fire_transition(t, once, context, binding={"x": "a"})
+    cpn.fire_transition(t, once, context, binding={"x": "a"})
+    cpn.fire_transition_n(t, n_times, context, binding={"x": "a"}, n=2)
+    assert repr(once) == repr(n_times)
+    assert len(n_times.get_multiset("P")) == 1
+    assert len(n_times.get_multiset("Q")) == 4
@@ -0,0 +1,36 @@
+import math
+
+import pandas as pd
+import pm4py
+
+from cpnpy.discovery import traditional
+
+
+def _log():
+    return pd.DataFrame({
+        "case:concept:name": ["1", "1", "2", "2"],
+        "concept:name": ["A", "B", "A", "B"],
+        "time:timestamp": pd.to_datetime(["2024-01-01 10:00", "2024-01-01 11:00",
+                                          "2024-01-02 10:00", "2024-01-02 11:00"]),
+        "amount": [float("nan")] * 4,
+        "score": [float("nan"), float("nan"), 1.5, 2.5],
+    })
+
+
+def test_all_null_case_attribute_stays_nan():
+    cpn, marking, context = traditional.apply(_log(), parameters={
+        "pro_disc_alg": lambda log, parameters: pm4py.discover_petri_net_inductive(log),
+        "original_case_attributes": {"case:concept:name", "amount", "score"},
+        "original_log_cases_in_im": True,
+        "num_simulated_cases": 2,
+        "enable_timing_discovery": False,
+    })
+
+    tokens = [tok.value for ms in marking._marking.values() for tok in ms.tokens]
+    assert len(tokens) == 2
+    for value in tokens:
+        # a guard like C["amount"] <= 3.5 must stay evaluable: NaN compares False, None raises
+        assert isinstance(value["amount"], float) and math.isnan(value["amount"])
+        assert not value["amount"] <= 3.5
+    scores = sorted((value["score"] for value in tokens), key=math.isnan)
+    assert scores[0] == 2.5 and math.isnan(scores[1])